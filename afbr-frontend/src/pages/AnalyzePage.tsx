@@ -136,7 +136,16 @@ export default function EcommerceAnalyzer() {
   };
 
   const pollReport = async (reportId: string) => {
+    // Backend worker gives up after ~8 minutes; stop polling a bit after that
+    const maxPolls = 120;
+    let polls = 0;
     const interval = setInterval(async () => {
+      polls += 1;
+      if (polls > maxPolls) {
+        setError('Report generation timed out');
+        clearInterval(interval);
+        return;
+      }
       try {
         if (!session?.access_token) return;
         const res = await fetch(`${API_BASE_URL}/api/report/${reportId}`, {
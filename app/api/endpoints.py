@@ -1,32 +1,57 @@
 from fastapi import APIRouter, UploadFile, HTTPException, Depends, Header, Request
-from sqlalchemy.orm import Session
-from datetime import datetime
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 import hashlib
 import json
 
 from app.core.database import get_db
+from app.core.queue import get_queue
 from app.models.models import User, Report
 from app.schemas.schemas import AnalysisResponse
 from app.services import file_service, ai_service
+from app.services.limit_service import check_daily_limit, release_daily_limit
 
 router = APIRouter()
 
 from fastapi.security import OAuth2PasswordBearer
 import os
 import jwt
+import time
+from cachetools import TTLCache
+from dataclasses import dataclass
 from typing import Optional
+from ulid import ULID
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
+# Verified JWT payloads keyed by a truncated SHA-256 of the raw token,
+# so repeat requests skip the signature check for a short while
+_token_cache = TTLCache(maxsize=10_000, ttl=30)
+
+@dataclass(frozen=True)
+class CurrentUser:
+    # Endpoints only need the identity, so cache this instead of a session-bound ORM row
+    id: str
+    email: str
+
+# email -> CurrentUser; no user fields are updated anywhere, so nothing to invalidate yet
+_user_cache = TTLCache(maxsize=5_000, ttl=60)
+
 # ... imports ...
 
-def verify_jwt(request: Request, token: Optional[str] = Depends(oauth2_scheme)):
+# async so the (non-thread-safe) token cache is only touched on the event loop
+async def verify_jwt(request: Request, token: Optional[str] = Depends(oauth2_scheme)):
     # Skip auth for OPTIONS (CORS preflight)
     if request.method == "OPTIONS":
         return None
     
     if not token:
         raise HTTPException(401, "Missing authentication token")
+
+    token_key = hashlib.sha256(token.encode()).digest()[:16]
+    cached = _token_cache.get(token_key)
+    if cached is not None and cached.get("exp", 0) > time.time():
+        return cached
     
     try:
         # Supabase JWT Secret should be in .env
@@ -38,16 +63,17 @@ def verify_jwt(request: Request, token: Optional[str] = Depends(oauth2_scheme)):
         
         # Decode and verify token
         payload = jwt.decode(token, secret, algorithms=["HS256"], audience="authenticated")
+        _token_cache[token_key] = payload
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(401, "Token has expired")
     except jwt.InvalidTokenError:
         raise HTTPException(401, "Invalid token")
 
-def get_or_create_user(
+async def get_or_create_user(
         token_payload: Optional[dict] = Depends(verify_jwt),
-        db: Session = Depends(get_db)
-) -> Optional[User]:
+        db: AsyncSession = Depends(get_db)
+) -> Optional[CurrentUser]:
     # If token_payload is None (OPTIONS request), return None
     if token_payload is None:
         return None
@@ -55,73 +81,103 @@ def get_or_create_user(
     email = token_payload.get("email")
     if not email:
         raise HTTPException(400, "Token missing email")
+
+    cached = _user_cache.get(email)
+    if cached is not None:
+        return cached
         
-    user = db.query(User).filter(User.email == email).first()
+    user = (await db.execute(select(User).where(User.email == email))).scalar_one_or_none()
     if not user:
-        # Use the Supabase User ID (sub) as the ID, or a stable hash
-        # To avoid migration issues with existing data, we stick to the hash logic for now
-        # OR better: use the 'sub' (UUID) from Supabase as the canonical ID if possible.
-        # But looking at models.py, ID is String(32). UUID is 36 chars.
-        # Check models.py again? It says String(32).
-        # We'll stick to MD5 of email to perform "Soft Migration" 
-        # (aka old users via header still map to same DB row if email matches)
+        # ULIDs are time-ordered, so new rows append to the end of the primary key index
+        # instead of landing at random pages like the old MD5-of-email IDs.
+        # Existing users keep their MD5 IDs - they are matched by email above.
         user = User(
-            id=hashlib.md5(email.encode()).hexdigest(),
+            id=str(ULID()),
             email=email,
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
-    return user
-
-def check_daily_limit(db: Session, user_id: str) -> bool:
-    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    # Simple check for existing completed reports today
-    count = db.query(Report).filter(
-        Report.user_id == user_id,
-        Report.created_at >= start,
-        Report.status == "completed"
-    ).count()
-    return count >= 1
+        await db.commit()
+
+    current = CurrentUser(id=user.id, email=user.email)
+    _user_cache[email] = current
+    return current
 
 @router.post("/analyze", response_model=AnalysisResponse)
 async def analyze_file(
     file: UploadFile,
-    user: Optional[User] = Depends(get_or_create_user),
-    db: Session = Depends(get_db),
+    user: Optional[CurrentUser] = Depends(get_or_create_user),
+    db: AsyncSession = Depends(get_db),
 ):
     # Early return for OPTIONS (CORS preflight) - this shouldn't be reached but as safety
     if user is None:
         return {}
     
-    if check_daily_limit(db, user.id):
+    limit_reached, limit_key = await check_daily_limit(db, user.id)
+    if limit_reached:
         raise HTTPException(429, "Daily limit reached (1 report per day)")
     
     # 1. Parse File
-    df = await file_service.parse_file(file)
+    try:
+        df = await file_service.parse_file(file)
+    except Exception:
+        await release_daily_limit(limit_key)
+        raise
+
+    # 2. Queue the analysis for the worker; the client polls /report/{id}
+    queue = await get_queue()
+    if queue is not None:
+        report = Report(
+            id=str(ULID()),
+            user_id=user.id,
+            filename=file.filename,
+            status="preprocessing",
+        )
+        db.add(report)
+        try:
+            await db.commit()
+        except Exception:
+            await release_daily_limit(limit_key)
+            raise
+
+        try:
+            await queue.enqueue_job("run_analysis", report.id, limit_key, df)
+        except Exception:
+            # Nothing will pick this report up; don't leave it polling as preprocessing
+            await release_daily_limit(limit_key)
+            report.status = "failed"
+            await db.commit()
+            raise
+
+        return AnalysisResponse(
+            report_id=report.id,
+            status=report.status,
+            created_at=report.created_at,
+            filename=report.filename
+        )
 
-    # 2. Create Report Entry
-    report_id = hashlib.md5(f"{user.id}{datetime.utcnow()}".encode()).hexdigest()
+    # 3. Queue not enabled: analyze inline
+    # Not added to the session yet: the row is written once, in a single
+    # transaction, when the analysis finishes
+    report_id = str(ULID())
     report = Report(
         id=report_id,
         user_id=user.id,
         filename=file.filename,
         status="preprocessing",
     )
-    db.add(report)
-    db.commit()
 
     try:
-        # 3. AI Mapping
+        # AI Mapping
         _, mapping = await ai_service.map_columns_ai(df.columns.tolist())
         report.column_mapping = mapping
         
-        # 4. AI Analysis
+        # AI Analysis
         analysis_result = await ai_service.analyze_data_ai(df, mapping)
         
         report.status = "completed"
         report.analysis = analysis_result
-        db.commit()
+        db.add(report)
+        await db.commit()
         
         return AnalysisResponse(
             report_id=report.id,
@@ -133,21 +189,30 @@ async def analyze_file(
         )
 
     except Exception as e:
-        report.status = "failed"
-        db.commit()
+        await db.rollback()
+        await release_daily_limit(limit_key)
+        await db.execute(insert(Report).values(
+            id=report_id,
+            user_id=user.id,
+            filename=file.filename,
+            status="failed",
+        ))
+        await db.commit()
         raise e
 
 @router.get("/report/{report_id}", response_model=AnalysisResponse)
 async def get_report(
     report_id: str,
-    user: Optional[User] = Depends(get_or_create_user),
-    db: Session = Depends(get_db),
+    user: Optional[CurrentUser] = Depends(get_or_create_user),
+    db: AsyncSession = Depends(get_db),
 ):
     # Early return for OPTIONS (shouldn't reach here but as safety)
     if user is None:
         return {}
     
-    report = db.query(Report).filter(Report.id == report_id, Report.user_id == user.id).first()
+    report = (await db.execute(
+        select(Report).where(Report.id == report_id, Report.user_id == user.id)
+    )).scalar_one_or_none()
     if not report:
         raise HTTPException(404, "Report not found")
     
@@ -1,6 +1,7 @@
-from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import redis.asyncio as redis
 import os
 from dotenv import load_dotenv
 
@@ -15,15 +16,45 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
+# Sync drivers -> their asyncio counterparts
+ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "mssql+pyodbc": "mssql+aioodbc",
+}
+
+def to_async_url(url: str):
+    """Rewrite a sync DATABASE_URL (as used by test_db_connection.py) for the async engine."""
+    parsed = make_url(url)
+    drivername = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    query = dict(parsed.query)
+    # asyncpg takes `ssl`, not libpq's `sslmode`
+    if drivername == "postgresql+asyncpg" and "sslmode" in query:
+        query["ssl"] = query.pop("sslmode")
+    return parsed.set(drivername=drivername, query=query)
+
 # fast_executemany is good for bulk inserts
 # fast_executemany is only for MSSQL, removing for Postgres compatibility
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# Pool sized per worker process: (pool_size + max_overflow) * workers
+# must stay under the database's connection limit.
+# pre_ping drops connections the server closed; recycle avoids idle timeouts.
+engine = create_async_engine(
+    to_async_url(DATABASE_URL),
+    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    pool_use_lifo=True,
+    query_cache_size=1200,
+)
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+# Optional: without REDIS_URL the daily limit falls back to counting reports in SQL
+REDIS_URL = os.getenv("REDIS_URL")
+redis_client = redis.from_url(REDIS_URL) if REDIS_URL else None
+
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,22 @@
+import os
+from typing import Optional
+from arq import create_pool
+from arq.connections import ArqRedis, RedisSettings
+
+from app.core.database import REDIS_URL
+
+# Jobs go to the arq worker (`arq app.worker.WorkerSettings`).
+# Queueing is opt-in: REDIS_URL alone only enables the daily-limit counter, and
+# without a running worker queued reports would never finish.
+redis_settings = RedisSettings.from_dsn(REDIS_URL) if REDIS_URL else None
+QUEUE_ENABLED = os.getenv("ANALYSIS_QUEUE_ENABLED", "").lower() in ("1", "true", "yes")
+
+_pool: Optional[ArqRedis] = None
+
+async def get_queue() -> Optional[ArqRedis]:
+    global _pool
+    if not QUEUE_ENABLED or redis_settings is None:
+        return None
+    if _pool is None:
+        _pool = await create_pool(redis_settings)
+    return _pool
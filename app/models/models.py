@@ -1,9 +1,10 @@
-from sqlalchemy import Column, String, DateTime, JSON
+from sqlalchemy import Column, String, DateTime, JSON, Index
 from datetime import datetime
 from app.core.database import Base
 
 class User(Base):
     __tablename__ = "users"
+    # New IDs are 26-char ULIDs; 32 still fits legacy MD5 IDs
     id = Column(String(32), primary_key=True)
     user_name = Column(String(255))
     industry = Column(String(255))
@@ -20,3 +21,8 @@ class Report(Base):
     column_mapping = Column(JSON, nullable=True)
     analysis = Column(JSON, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Covers the daily-limit count: equality columns first, then the created_at range
+    __table_args__ = (
+        Index("ix_reports_user_day", "user_id", "status", "created_at"),
+    )
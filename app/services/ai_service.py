@@ -1,82 +1,223 @@
 import os
+import re
 import json
-from openai import OpenAI
-from typing import Dict, Tuple, List
+import asyncio
+import openai
+from openai import AsyncOpenAI
+from typing import Dict, Tuple, List, Optional
 import pandas as pd
+from cachetools import LRUCache
+from rapidfuzz import fuzz, process
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception_type
 from fastapi import HTTPException
 from dotenv import load_dotenv
 
+from app.schemas.schemas import AnalysisContent
+
 load_dotenv()
 
 
-def get_client():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError("OPENAI_API_KEY is not set in environment variables")
-    return OpenAI(api_key=api_key)
+# Per-attempt request timeout and retry budget for OpenAI calls.
+# The arq worker's job_timeout is derived from these (see AI_CALL_BUDGET).
+OPENAI_TIMEOUT = 60
+OPENAI_ATTEMPTS = 3
+OPENAI_MAX_WAIT = 10
+# Worst case for one retried call; an analysis makes at most two (mapping + insights)
+AI_CALL_BUDGET = OPENAI_ATTEMPTS * OPENAI_TIMEOUT + (OPENAI_ATTEMPTS - 1) * OPENAI_MAX_WAIT
 
-async def map_columns_ai(headers: List[str]) -> Tuple[str, Dict]:
-    prompt = f"""
-    You are a Data Analyst. content: {', '.join(headers)}
-    Return JSON mapping strictly:
-    {{
-    "order_id": "col_name_or_null",
-    "date": "col_name_or_null",
-    "revenue": "col_name_or_null",
-    "quantity": "col_name_or_null",
-    "product": "col_name_or_null",
-    "customer": "col_name_or_null",
-    "category": "col_name_or_null"
-    }}
-    """
-    
+_client: Optional[AsyncOpenAI] = None
+
+def get_client() -> AsyncOpenAI:
+    # One shared client so its HTTP connection pool is reused across requests
+    global _client
+    if _client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY is not set in environment variables")
+        # Retries are handled by openai_retry below; SDK retries would multiply them
+        _client = AsyncOpenAI(api_key=api_key, max_retries=0, timeout=OPENAI_TIMEOUT)
+    return _client
+
+# Transient OpenAI failures (rate limits, timeouts, 5xx) get jittered backoff
+openai_retry = retry(
+    stop=stop_after_attempt(OPENAI_ATTEMPTS),
+    wait=wait_exponential_jitter(initial=1, max=OPENAI_MAX_WAIT),
+    retry=retry_if_exception_type((
+        openai.RateLimitError,
+        openai.APIConnectionError, # includes APITimeoutError
+        openai.InternalServerError,
+    )),
+    reraise=True,
+)
+
+# Accounting negatives: "(123.45)" -> "-123.45"
+_PARENS_RE = re.compile(r'^\s*\((.*)\)\s*$')
+# Currency/text symbols ($, ,, %, space, letters) - keep only digits, dots, minus signs
+_CLEAN_RE = re.compile(r'[^\d.\-]')
+
+# --- Helper: Robust Numeric Cleaning ---
+def clean_numeric_series(series: pd.Series) -> pd.Series:
+    # Columns the reader already parsed as numbers (incl. nullable / Arrow-backed ints)
+    # skip the string pipeline; normalize to plain float64 like the cleaned path
+    if pd.api.types.is_numeric_dtype(series):
+        return series.fillna(0).astype("float64")
+
+    # 'nan', 'null', 'none' and blanks are stripped to '' and coerced to 0 below
+    s = series.astype(str).str.replace(_PARENS_RE, r'-\1', regex=True)
+    s = s.str.replace(_CLEAN_RE, '', regex=True)
+
+    # Multiple dots (e.g. 1.2.3) and empty strings -> NaN -> 0
+    return pd.to_numeric(s, errors='coerce').fillna(0)
+
+# Known header spellings per canonical field, in normalized form (see _normalize_header).
+# Ordered by priority: when several headers match a field, the earliest synonym wins.
+# Lists must stay disjoint so an exact header only ever matches one field.
+COLUMN_SYNONYMS = {
+    "order_id": ["order_id", "orderid", "order_no", "order_number", "invoice_id", "invoice_no", "invoice", "transaction_id"],
+    "date": ["date", "order_date", "sale_date", "invoice_date", "transaction_date", "created_at", "created", "timestamp"],
+    "revenue": ["revenue", "total", "sales", "amount", "net_sales", "sales_amount", "order_total", "total_amount", "total_price"],
+    "quantity": ["quantity", "qty", "units", "quantity_ordered", "units_sold"],
+    "product": ["product", "product_name", "item", "item_name", "sku", "description"],
+    "customer": ["customer", "customer_id", "customer_name", "client", "buyer"],
+    "category": ["category", "product_category", "segment", "department", "type"],
+}
+# Without these the analysis can't run, so anything less goes to the LLM
+REQUIRED_FIELDS = ("revenue", "date")
+MATCH_SCORE_CUTOFF = 85
+
+# Static instructions live in the system turn; only per-request data goes in the user turn
+SYSTEM_PROMPT_MAP = """
+You are a Data Analyst. The user message lists the column headers of a sales file.
+Return JSON mapping strictly:
+{
+"order_id": "col_name_or_null",
+"date": "col_name_or_null",
+"revenue": "col_name_or_null",
+"quantity": "col_name_or_null",
+"product": "col_name_or_null",
+"customer": "col_name_or_null",
+"category": "col_name_or_null"
+}
+"""
+
+SYSTEM_PROMPT_ANALYSIS = """
+Analyze e-commerce data. The user message gives the metrics, daily trend and top categories.
+Copy the metrics into "summary" unchanged.
+
+Return JSON:
+{
+    "summary": {
+        "total_orders": <Orders>,
+        "total_revenue": <Rev>,
+        "total_items_sold": <Qty>
+    },
+    "insights": ["3 distinct strategic insights"],
+    "recommendations": ["3 actionable steps"],
+    "sales_trend": [
+        {"name": "YYYY-MM-DD", "value": 123.45}
+    ] (Limit to 20 points for chart),
+    "category_breakdown": [
+        {"name": "CategoryName", "value": 1000}
+    ]
+}
+"""
+
+# Sorted header tuple -> mapping; repeat uploads of the same export skip the LLM
+_mapping_cache = LRUCache(maxsize=1024)
+
+def _normalize_header(header) -> str:
+    return re.sub(r'[\s\-]+', '_', str(header).strip().lower())
+
+def _closest_field(norm: str) -> Optional[Tuple[str, float, int]]:
+    # (field, score, synonym rank) of the single best fuzzy match across all fields
+    best = None
+    for field, synonyms in COLUMN_SYNONYMS.items():
+        match = process.extractOne(norm, synonyms, scorer=fuzz.ratio, score_cutoff=MATCH_SCORE_CUTOFF)
+        if match and (best is None or match[1] > best[1]):
+            best = (field, match[1], match[2])
+    return best
+
+def map_columns_local(headers: List[str]) -> Dict[str, Optional[str]]:
+    normalized = {h: _normalize_header(h) for h in headers}
+    mapping = dict.fromkeys(COLUMN_SYNONYMS)
+    used = set()
+
+    # 1. Exact matches take priority over any fuzzy match, ranked by synonym order
+    for field, synonyms in COLUMN_SYNONYMS.items():
+        exact = [(synonyms.index(norm), h) for h, norm in normalized.items() if norm in synonyms]
+        if exact:
+            header = min(exact, key=lambda e: e[0])[1]
+            mapping[field] = header
+            used.add(header)
+
+    # 2. Fuzzy matches fill the remaining fields. A header only competes for the
+    # field it is closest to, so e.g. "item" can't fall through to quantity's list.
+    candidates = {}
+    for header, norm in normalized.items():
+        if header in used:
+            continue
+        closest = _closest_field(norm)
+        if closest and mapping[closest[0]] is None:
+            field, score, rank = closest
+            candidates.setdefault(field, []).append((-score, rank, header))
+    for field, options in candidates.items():
+        mapping[field] = min(options, key=lambda o: o[:2])[2]
+
+    return mapping
+
+@openai_retry
+async def _request_mapping(headers: List[str]):
     client = get_client()
-    response = client.chat.completions.create(
+    return await client.chat.completions.create(
         model="gpt-4o-mini", # Improved model if available, or fallback to 4.1-mini alias
-        messages=[{"role": "user", "content": prompt}],
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT_MAP},
+            {"role": "user", "content": ", ".join(str(h) for h in headers)},
+        ],
         max_tokens=500,
         response_format={ "type": "json_object" }
     )
+
+def _is_cacheable_mapping(mapping, headers: List[str]) -> bool:
+    if not isinstance(mapping, dict):
+        return False
+    known = set(headers)
+    if any(value is not None and value not in known for value in mapping.values()):
+        return False
+    return all(mapping.get(field) for field in REQUIRED_FIELDS)
+
+async def map_columns_ai(headers: List[str]) -> Tuple[str, Dict]:
+    cache_key = tuple(sorted(str(h) for h in headers))
+    cached = _mapping_cache.get(cache_key)
+    if cached is not None:
+        return json.dumps(cached), dict(cached)
+
+    # Common headers resolve locally without an LLM round-trip
+    mapping = map_columns_local(headers)
+    if all(mapping.get(field) for field in REQUIRED_FIELDS):
+        _mapping_cache[cache_key] = mapping
+        return json.dumps(mapping), dict(mapping)
+
+    response = await _request_mapping(headers)
     
     content = response.choices[0].message.content
     try:
         mapping = json.loads(content)
     except json.JSONDecodeError:
         raise HTTPException(500, "Failed to parse AI mapping")
-        
-    return content, mapping
 
-async def analyze_data_ai(df: pd.DataFrame, mapping: Dict) -> Dict:
-    # Pre-calculate what we can to save tokens and ensure accuracy
+    # Only a usable reply is reused for later uploads; a bad one is returned
+    # as-is (and fails downstream) but the next upload asks the LLM again
+    if _is_cacheable_mapping(mapping, headers):
+        _mapping_cache[cache_key] = mapping
+    return content, dict(mapping)
+
+def _compute_summary(df: pd.DataFrame, mapping: Dict) -> Dict:
+    # CPU-bound pandas work; run via asyncio.to_thread to keep the event loop free
     rev_col = mapping.get("revenue")
     qty_col = mapping.get("quantity")
     date_col = mapping.get("date")
     cat_col = mapping.get("category")
-    
-    if not rev_col or rev_col not in df.columns:
-        raise HTTPException(400, "Revenue column missing")
-
-    # --- Helper: Robust Numeric Cleaning ---
-    def clean_numeric_series(series: pd.Series) -> pd.Series:
-        # 1. Convert to string, lowercase, strip whitespace
-        s = series.astype(str).str.lower().str.strip()
-        
-        # Handle 'null', 'nan', 'none' strings explicitly
-        s = s.replace({'nan': '0', 'null': '0', 'none': '0', '': '0'})
-
-        # 2. Handle Accounting Negatives: (123.45) -> -123.45
-        # Check if starts with '(' and ends with ')'
-        mask_parens = s.str.startswith('(') & s.str.endswith(')')
-        # Remove parens and prepend '-' for those rows
-        s.loc[mask_parens] = '-' + s.loc[mask_parens].str.strip('()')
-
-        # 3. Remove common currency/text symbols ($, ,, %, space, letters)
-        # We keep only digits, dots, minus signs.
-        s = s.str.replace(r'[^\d.-]', '', regex=True)
-        
-        # 4. Handle multiple dots error (e.g. 1.2.3 -> NaN -> 0)
-        # Convert to numeric, coercing errors to NaN, then fill 0
-        return pd.to_numeric(s, errors='coerce').fillna(0)
 
     # --- Apply Cleaning ---
     df[rev_col] = clean_numeric_series(df[rev_col])
@@ -93,60 +234,80 @@ async def analyze_data_ai(df: pd.DataFrame, mapping: Dict) -> Dict:
     trend_data = []
     if date_col and date_col in df.columns:
         try:
-            # Attempt to parse dates
-            df['temp_date'] = pd.to_datetime(df[date_col], errors='coerce')
-            daily = df.groupby(df['temp_date'].dt.strftime('%Y-%m-%d'))[rev_col].sum().reset_index()
-            # Limit to last 30 entries to save context
-            trend_data = daily.tail(30).to_dict('records')
+            # Attempt to parse dates; group on the day itself (no df copy, no per-row strftime)
+            dates = pd.to_datetime(df[date_col], errors='coerce').dt.floor('D')
+            daily = df.groupby(dates, sort=False)[rev_col].sum()
+            # Limit to last 30 entries to save context; format only those
+            daily = daily.sort_index().tail(30)
+            trend_data = [{"name": d.strftime('%Y-%m-%d'), "value": float(v)} for d, v in daily.items()]
         except Exception:
             pass
 
     # 2. Category Breakdown
     cat_data = []
     if cat_col and cat_col in df.columns:
-        cat_group = df.groupby(cat_col)[rev_col].sum().sort_values(ascending=False).head(5)
+        cat_group = df.groupby(cat_col, sort=False, observed=True)[rev_col].sum().sort_values(ascending=False).head(5)
         cat_data = [{"name": k, "value": v} for k, v in cat_group.items()]
 
+    return {
+        "total_revenue": total_revenue,
+        "total_qty": total_qty,
+        "total_orders": total_orders,
+        "trend_data": trend_data,
+        "cat_data": cat_data,
+    }
+
+@openai_retry
+async def _request_analysis(prompt: str) -> Optional[AnalysisContent]:
+    # Structured output: the SDK sends AnalysisContent as a strict json_schema,
+    # so the reply always validates. `parsed` is None only if the model refuses.
+    client = get_client()
+    response = await client.beta.chat.completions.parse(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT_ANALYSIS},
+            {"role": "user", "content": prompt},
+        ],
+        max_tokens=1000,
+        response_format=AnalysisContent,
+    )
+    return response.choices[0].message.parsed
+
+async def analyze_data_ai(df: pd.DataFrame, mapping: Dict) -> Dict:
+    # Pre-calculate what we can to save tokens and ensure accuracy
+    rev_col = mapping.get("revenue")
+    if not rev_col or rev_col not in df.columns:
+        raise HTTPException(400, "Revenue column missing")
+
+    summary = await asyncio.to_thread(_compute_summary, df, mapping)
+    total_revenue = summary["total_revenue"]
+    total_qty = summary["total_qty"]
+    total_orders = summary["total_orders"]
+    trend_data = summary["trend_data"]
+    cat_data = summary["cat_data"]
+
     prompt = f"""
-    Analyze e-commerce data. 
     Metrics: Rev ${total_revenue}, Qty {total_qty}, Orders {total_orders}.
     
     Trend (Last 30 pts): {json.dumps(trend_data)}
     Top Categories: {json.dumps(cat_data)}
-    
-    Return JSON:
-    {{
-        "summary": {{ 
-            "total_orders": {total_orders}, 
-            "total_revenue": {total_revenue}, 
-            "total_items_sold": {total_qty} 
-        }},
-        "insights": ["3 distinct strategic insights"],
-        "recommendations": ["3 actionable steps"],
-        "sales_trend": [
-            {{"name": "YYYY-MM-DD", "value": 123.45}} 
-        ] (Limit to 20 points for chart),
-        "category_breakdown": [
-            {{"name": "CategoryName", "value": 1000}}
-        ]
-    }}
     """
 
-    client = get_client()
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=1000,
-        response_format={ "type": "json_object" }
-    )
-
     try:
-        return json.loads(response.choices[0].message.content)
-    except:
-        return {
-            "summary": {"total_orders": total_orders, "total_revenue": total_revenue, "total_items_sold": total_qty},
-            "insights": ["Could not generate insights"],
-            "recommendations": [],
-            "sales_trend": [],
-            "category_breakdown": []
-        }
+        content = await _request_analysis(prompt)
+    except (openai.LengthFinishReasonError, openai.ContentFilterFinishReasonError):
+        content = None
+
+    # Totals come from pandas, never from the model's echo of them
+    totals = {"total_orders": total_orders, "total_revenue": total_revenue, "total_items_sold": total_qty}
+    if content is not None:
+        result = content.model_dump()
+        result["summary"] = totals
+        return result
+    return {
+        "summary": totals,
+        "insights": ["Could not generate insights"],
+        "recommendations": [],
+        "sales_trend": [],
+        "category_breakdown": []
+    }
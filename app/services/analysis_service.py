@@ -0,0 +1,40 @@
+import pandas as pd
+from typing import Optional
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import SessionLocal
+from app.models.models import Report
+from app.services import ai_service
+from app.services.limit_service import release_daily_limit
+
+async def _fail_report(db: AsyncSession, report_id: str, limit_key: Optional[str]):
+    await release_daily_limit(limit_key)
+    await db.execute(update(Report).where(Report.id == report_id).values(status="failed"))
+    await db.commit()
+
+async def run_analysis(report_id: str, limit_key: Optional[str], df: pd.DataFrame, job_try: int = 1):
+    # Fill in a queued report; runs in the arq worker with its own session
+    async with SessionLocal() as db:
+        report = await db.get(Report, report_id)
+        # Already completed or failed (e.g. by an earlier try): nothing to do
+        if report is None or report.status != "preprocessing":
+            return
+
+        if job_try > 1:
+            # The previous try died without reaching its except block (worker killed,
+            # OOM); fail the report instead of re-running the paid OpenAI calls
+            await _fail_report(db, report_id, limit_key)
+            return
+
+        try:
+            _, mapping = await ai_service.map_columns_ai(df.columns.tolist())
+            report.column_mapping = mapping
+            report.analysis = await ai_service.analyze_data_ai(df, mapping)
+            report.status = "completed"
+            await db.commit()
+        except BaseException:
+            # BaseException so an arq job timeout (CancelledError) still fails the report
+            await db.rollback()
+            await _fail_report(db, report_id, limit_key)
+            raise
@@ -1,23 +1,59 @@
+import asyncio
 import pandas as pd
 import io
 from fastapi import UploadFile, HTTPException
 
 MAX_FILE_SIZE = 5 * 1024 * 1024 # 5MB
 MAX_ROWS = 10_000
+READ_CHUNK_SIZE = 64 * 1024 # 64KB
+# Allowance for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024 # 64KB
 
-async def parse_file(file: UploadFile) -> pd.DataFrame:
-    contents = await file.read()
+def _dedupe_columns(columns) -> list:
+    # The pyarrow engine keeps duplicate and blank headers as-is; rename them the
+    # way the C engine does ("sales", "sales.1", "Unnamed: 0") so df[col] stays a Series
+    seen = set()
+    counts = {}
+    result = []
+    for i, col in enumerate(columns):
+        base = col if col != "" else f"Unnamed: {i}"
+        name = base
+        n = counts.get(base, 0)
+        while name in seen:
+            n += 1
+            name = f"{base}.{n}"
+        counts[base] = n
+        seen.add(name)
+        result.append(name)
+    return result
 
-    if len(contents) > MAX_FILE_SIZE:
-        raise HTTPException(400, "File too large (max 5MB)")
+def _read_csv(contents: bytes) -> pd.DataFrame:
+    try:
+        df = pd.read_csv(io.BytesIO(contents), engine="pyarrow", dtype_backend="pyarrow")
+    except pd.errors.ParserError:
+        # pyarrow rejects ragged rows (exporters often drop trailing empty cells);
+        # the C engine pads them with NaN, so fall back to it
+        return pd.read_csv(io.BytesIO(contents))
+    df.columns = _dedupe_columns(df.columns)
+    return df
+
+async def parse_file(file: UploadFile) -> pd.DataFrame:
+    # Starlette has already spooled the upload by now (oversize requests with a
+    # Content-Length are rejected earlier, in main.py); reading in chunks only
+    # bounds our own in-memory copy
+    contents = bytearray()
+    while chunk := await file.read(READ_CHUNK_SIZE):
+        if len(contents) + len(chunk) > MAX_FILE_SIZE:
+            raise HTTPException(400, "File too large (max 5MB)")
+        contents.extend(chunk)
 
     try:
         if file.filename.endswith(".csv"):
-            df = pd.read_csv(io.BytesIO(contents))
+            df = await asyncio.to_thread(_read_csv, contents)
         elif file.filename.endswith(".xlsx"):
-            df = pd.read_excel(io.BytesIO(contents), engine="openpyxl")
+            df = await asyncio.to_thread(pd.read_excel, io.BytesIO(contents), engine="calamine")
         elif file.filename.endswith(".xls"):
-            df = pd.read_excel(io.BytesIO(contents), engine="xlrd")
+            df = await asyncio.to_thread(pd.read_excel, io.BytesIO(contents), engine="xlrd")
         else:
             raise HTTPException(400, "Unsupported file format. Please upload CSV or Excel.")
     except Exception as e:
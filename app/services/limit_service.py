@@ -0,0 +1,42 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import Optional, Tuple
+
+from app.core.database import redis_client
+from app.models.models import Report
+
+DAILY_LIMIT = 1
+
+def _daily_key(user_id: str) -> str:
+    return f"rl:{user_id}:{datetime.utcnow():%Y%m%d}"
+
+async def check_daily_limit(db: AsyncSession, user_id: str) -> Tuple[bool, Optional[str]]:
+    # Returns (limit_reached, claimed_key). Pass the key to release_daily_limit so a
+    # refund after UTC midnight still hits the day the slot was claimed on.
+    if redis_client is not None:
+        # Fixed-window counter: INCR claims today's slot atomically, so two
+        # concurrent uploads can't both pass. Refunded if over the limit or on failure.
+        key = _daily_key(user_id)
+        count = await redis_client.incr(key)
+        if count == 1:
+            await redis_client.expire(key, 90000)
+        if count > DAILY_LIMIT:
+            await redis_client.decr(key)
+            return True, None
+        return False, key
+
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    # Simple check for existing completed reports today
+    count = (await db.execute(
+        select(func.count()).select_from(Report).where(
+            Report.user_id == user_id,
+            Report.created_at >= start,
+            Report.status == "completed"
+        )
+    )).scalar()
+    return count >= DAILY_LIMIT, None
+
+async def release_daily_limit(key: Optional[str]):
+    if redis_client is not None and key is not None:
+        await redis_client.decr(key)
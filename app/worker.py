@@ -0,0 +1,17 @@
+from typing import Optional
+
+from app.core.queue import redis_settings
+from app.services import ai_service
+from app.services.analysis_service import run_analysis as _run_analysis
+
+async def run_analysis(ctx, report_id: str, limit_key: Optional[str], df):
+    await _run_analysis(report_id, limit_key, df, job_try=ctx["job_try"])
+
+class WorkerSettings:
+    functions = [run_analysis]
+    redis_settings = redis_settings
+    # The second try only runs if the first one was killed mid-job; run_analysis
+    # then marks the report failed and refunds the slot rather than re-running it
+    max_tries = 2
+    # Must outlast both retried OpenAI calls, or arq cancels the job mid-retry
+    job_timeout = 2 * ai_service.AI_CALL_BUDGET + 60
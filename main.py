@@ -1,17 +1,48 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 import os
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+from sqlalchemy.exc import IntegrityError, ProgrammingError
 
 from app.core.database import engine, Base
 from app.api.endpoints import router as api_router
+from app.services.file_service import MAX_FILE_SIZE, MULTIPART_OVERHEAD
 
 load_dotenv()
 
 # Create Tables
-Base.metadata.create_all(bind=engine)
+async def create_tables():
+    # Every worker runs this at startup. On a fresh database two workers can both
+    # pass create_all's existence check; the loser gets "already exists", and its
+    # retry sees the tables and does nothing.
+    for attempt in range(2):
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            return
+        except (IntegrityError, ProgrammingError):
+            if attempt:
+                raise
 
-app = FastAPI(title="AI For Business Report", version="2.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await create_tables()
+    yield
+    await engine.dispose()
+
+app = FastAPI(title="AI For Business Report", version="2.0", lifespan=lifespan)
+
+# Reject oversize uploads from Content-Length before Starlette spools the multipart
+# body to disk. Registered before CORS so the 413 still carries CORS headers.
+# Chunked bodies without a length are still bounded by parse_file's read loop.
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+        return JSONResponse({"detail": "File too large (max 5MB)"}, status_code=413)
+    return await call_next(request)
 
 # CORS Configuration - Include production frontend URL
 # Set CORS_ORIGINS environment variable on Render to override
@@ -61,4 +92,12 @@ async def debug_env():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Multiple workers need the import string; each one gets its own DB pool (see DB_POOL_SIZE)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="auto",
+        http="auto",
+    )
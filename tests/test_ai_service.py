@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+from cachetools import LRUCache
+
+from app.services import ai_service
+from app.services.ai_service import map_columns_local
+
+
+@pytest.mark.parametrize("headers, field, expected", [
+    # Unit price must not be taken for revenue
+    (["Price", "Sales", "Date"], "revenue", "Sales"),
+    (["order_id", "date", "item", "price", "total", "qty"], "revenue", "total"),
+    # Exact header beats a lower-ranked synonym that appears first
+    (["Date", "Sales", "Type", "Category"], "category", "Category"),
+    (["created", "date", "amount"], "date", "date"),
+    # A product-name column must not fuzzy-match into quantity
+    (["Date", "Item", "Total"], "quantity", None),
+    (["Date", "Item", "Total"], "product", "Item"),
+])
+def test_map_columns_local(headers, field, expected):
+    assert map_columns_local(headers)[field] == expected
+
+
+def test_map_columns_local_fuzzy_and_normalized():
+    mapping = map_columns_local(["Order Date", "Net-Sales", "Quantity Ordred", "Customer Name"])
+    assert mapping["date"] == "Order Date"
+    assert mapping["revenue"] == "Net-Sales"
+    assert mapping["quantity"] == "Quantity Ordred"
+    assert mapping["customer"] == "Customer Name"
+
+
+def test_map_columns_local_assigns_each_header_once():
+    mapping = map_columns_local(["Date", "Sales", "Product", "Category"])
+    values = [v for v in mapping.values() if v is not None]
+    assert len(values) == len(set(values))
+
+
+class _FakeResponse:
+    def __init__(self, content: str):
+        message = type("Message", (), {"content": content})()
+        self.choices = [type("Choice", (), {"message": message})()]
+
+
+@pytest.mark.parametrize("reply", [
+    # Names a column that doesn't exist
+    {"revenue": "Revenue", "date": "When"},
+    # Leaves a required field unresolved
+    {"revenue": "Amt", "date": None},
+])
+def test_map_columns_ai_does_not_cache_unusable_replies(monkeypatch, reply):
+    calls = []
+
+    async def fake_request(headers):
+        calls.append(headers)
+        return _FakeResponse(json.dumps(reply))
+
+    monkeypatch.setattr(ai_service, "_request_mapping", fake_request)
+    monkeypatch.setattr(ai_service, "_mapping_cache", LRUCache(maxsize=8))
+    headers = ["Amt", "When"]
+
+    for _ in range(2):
+        _, mapping = asyncio.run(ai_service.map_columns_ai(headers))
+        assert mapping == reply
+    assert len(calls) == 2
+
+
+def test_map_columns_ai_caches_valid_reply(monkeypatch):
+    calls = []
+
+    async def fake_request(headers):
+        calls.append(headers)
+        return _FakeResponse(json.dumps({"revenue": "Amt", "date": "When", "category": None}))
+
+    monkeypatch.setattr(ai_service, "_request_mapping", fake_request)
+    monkeypatch.setattr(ai_service, "_mapping_cache", LRUCache(maxsize=8))
+    headers = ["Amt", "When"]
+
+    for _ in range(2):
+        asyncio.run(ai_service.map_columns_ai(headers))
+    assert len(calls) == 1
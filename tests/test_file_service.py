@@ -0,0 +1,22 @@
+import asyncio
+import io
+
+from fastapi import UploadFile
+
+from app.services.file_service import parse_file
+
+
+def _parse(filename: str, data: bytes):
+    return asyncio.run(parse_file(UploadFile(io.BytesIO(data), filename=filename)))
+
+
+def test_parse_csv_renames_duplicate_and_blank_headers():
+    df = _parse("orders.csv", b"sales,sales,,date\n1,2,3,2024-01-01\n")
+    assert list(df.columns) == ["sales", "sales.1", "Unnamed: 2", "date"]
+
+
+def test_parse_csv_pads_ragged_rows():
+    df = _parse("orders.csv", b"a,b,c\n1,2,3\n4,5\n")
+    assert list(df.columns) == ["a", "b", "c"]
+    assert len(df) == 2
+    assert df["c"].isna().iloc[1]
@@ -0,0 +1,64 @@
+import asyncio
+
+from app.services import limit_service
+from app.services.limit_service import check_daily_limit, release_daily_limit
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    async def incr(self, key):
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+    async def decr(self, key):
+        self.values[key] = self.values.get(key, 0) - 1
+        return self.values[key]
+
+    async def expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+
+def _fake_redis(monkeypatch) -> FakeRedis:
+    redis = FakeRedis()
+    monkeypatch.setattr(limit_service, "redis_client", redis)
+    return redis
+
+
+def test_first_claim_sets_ttl(monkeypatch):
+    redis = _fake_redis(monkeypatch)
+
+    limited, key = asyncio.run(check_daily_limit(None, "user-1"))
+
+    assert limited is False
+    assert redis.values[key] == 1
+    assert redis.ttls[key] == 90000
+
+
+def test_second_claim_is_rejected_without_consuming(monkeypatch):
+    redis = _fake_redis(monkeypatch)
+    _, key = asyncio.run(check_daily_limit(None, "user-1"))
+
+    assert asyncio.run(check_daily_limit(None, "user-1")) == (True, None)
+    assert redis.values[key] == 1
+
+
+def test_release_decrements_the_claimed_key(monkeypatch):
+    redis = _fake_redis(monkeypatch)
+    _, key = asyncio.run(check_daily_limit(None, "user-1"))
+
+    # The refund must not recompute the key, e.g. after UTC midnight
+    monkeypatch.setattr(limit_service, "_daily_key", lambda user_id: f"rl:{user_id}:next-day")
+    asyncio.run(release_daily_limit(key))
+
+    assert redis.values == {key: 0}
+
+
+def test_release_without_key_is_a_no_op(monkeypatch):
+    redis = _fake_redis(monkeypatch)
+
+    asyncio.run(release_daily_limit(None))
+
+    assert redis.values == {}